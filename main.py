@@ -1,22 +1,95 @@
 # === IMPORTS ===
 import logging
+import logging.handlers
 import os
 import asyncio
-from threading import Thread
-from flask import Flask
+import atexit
+import queue
+import signal
+import time
+from aiohttp import web
+from pythonjsonlogger import jsonlogger
 from telegram import Update
-# CommandHandler is now imported to handle the /ping command
-from telegram.ext import Application, MessageHandler, CommandHandler, filters, ContextTypes
+from telegram.error import BadRequest, NetworkError, TelegramError, TimedOut
+from telegram.request import HTTPXRequest
+from telegram.ext import AIORateLimiter, Application, MessageHandler, filters, ContextTypes
 
 # === LOGGING SETUP ===
 # A good logging setup is crucial for debugging a bot that runs 24/7.
 # This will print informative messages to the console.
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# Only warnings and errors are printed by default, since a line per forwarded
+# message adds up quickly. Set LOG_LEVEL=INFO or LOG_LEVEL=DEBUG for more detail.
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "WARNING").upper()
+log_level = getattr(logging, LOG_LEVEL, None)
+# Only real level names count; anything else (e.g. "BASIC_FORMAT") falls back to WARNING.
+if not isinstance(log_level, int):
+    log_level = logging.WARNING
+logging.basicConfig(level=log_level)
+# Writing to stderr blocks, so we move the write off the event loop: the root
+# logger's QueueHandler formats each record on the calling thread (message
+# interpolation and any traceback), then puts it on an in-memory queue. A
+# background listener thread owns the real StreamHandler and does the writing.
+root_logger = logging.getLogger()
+stream_handler = root_logger.handlers[0]
+root_logger.removeHandler(stream_handler)
+# Records are written as JSON lines, so fields passed via `extra` (like msg_id)
+# can be filtered and counted by log tooling without parsing the message text.
+stream_handler.setFormatter(jsonlogger.JsonFormatter('%(asctime)s %(name)s %(levelname)s %(message)s'))
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """A QueueHandler that drops records when the queue is full instead of raising."""
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # If the writer thread falls behind, losing log lines is better than
+            # blocking the bot or letting memory grow without limit.
+            pass
+
+
+class BoundedQueueListener(logging.handlers.QueueListener):
+    """A QueueListener whose stop() still works when the queue is full."""
+
+    def enqueue_sentinel(self) -> None:
+        # The listener thread keeps draining the queue, so a blocking put is
+        # guaranteed to finish, whereas put_nowait could raise queue.Full here.
+        self.queue.put(self._sentinel)
+
+
+class RepeatFilter(logging.Filter):
+    """Lets through at most one record per message text within each time window."""
+
+    def __init__(self, messages: tuple[str, ...], window: float) -> None:
+        super().__init__()
+        self.messages = messages
+        self.window = window
+        self.last_seen: dict[str, float] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.msg not in self.messages:
+            return True
+        now = time.monotonic()
+        if now - self.last_seen.get(record.msg, float('-inf')) < self.window:
+            return False
+        self.last_seen[record.msg] = now
+        return True
+
+
+# The queue is capped so a stalled writer can't use unbounded memory during a burst.
+log_queue = queue.Queue(maxsize=10_000)
+root_logger.addHandler(DroppingQueueHandler(log_queue))
+log_listener = BoundedQueueListener(log_queue, stream_handler, respect_handler_level=True)
+# The listener is started right away so startup errors are written too,
+# and stopped at exit so queued records are flushed before the process ends.
+log_listener.start()
+atexit.register(log_listener.stop)
+
 # We get the logger instance to use it in our functions.
 logger = logging.getLogger(__name__)
+# forward_ok is logged for every message, so at DEBUG we keep at most one every 5 seconds.
+logger.addFilter(RepeatFilter(messages=("forward_ok",), window=5.0))
 
 # === CONFIGURATION ===
 # Load configuration from Environment Variables.
@@ -27,85 +100,168 @@ try:
     SOURCE_CHAT_ID = int(os.environ['GROUP_A_ID'])
     DESTINATION_CHAT_ID = int(os.environ['GROUP_B_ID'])
 except (KeyError, ValueError) as e:
-    logger.critical(f"CRITICAL ERROR: Missing or invalid environment variable: {e}. Please check your hosting environment variables.")
+    logger.critical("CRITICAL ERROR: Missing or invalid environment variable: %s. Please check your hosting environment variables.", e)
     # Exit if the configuration is missing, as the bot cannot run.
     exit()
 
 # === KEEP-ALIVE SERVER (FOR RENDER DEPLOYMENT) ===
-# This Flask server is what Render's health check will ping to keep the service alive.
-server = Flask('')
+# This small aiohttp app is what Render's health check will ping to keep the service alive.
+# It runs on the same event loop as the bot, so no extra thread or WSGI server is needed.
+# The body is encoded once here rather than on every health check.
+HEALTH_BODY = b"Telegram Forwarder Bot is alive and running!"
 
-@server.route('/')
-def home():
+async def health(request: web.Request) -> web.Response:
     # This page confirms to you and the Render service that the bot is running.
-    return "Telegram Forwarder Bot is alive and running!"
+    return web.Response(body=HEALTH_BODY, content_type="text/plain")
 
-def run_flask_server():
-    """Runs the Flask server in a separate thread to not block the bot."""
-    # The server runs in a daemon thread. This means the thread will exit
-    # when the main program (the bot) exits.
-    thread = Thread(target=lambda: server.run(host='0.0.0.0', port=8080))
-    thread.daemon = True
-    thread.start()
-    logger.info("Flask keep-alive server started in a background thread.")
+async def start_health_server() -> web.AppRunner:
+    """Starts the keep-alive HTTP server on the current event loop."""
+    app = web.Application()
+    app.add_routes([web.get('/', health)])
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '0.0.0.0', 8080).start()
+    logger.info("Keep-alive server started on port 8080.")
+    return runner
 
 # === TELEGRAM BOT LOGIC ===
 
-# NEW: Handler for the /ping command
-async def ping_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Sends a message back to the user when the command /ping is issued."""
-    # This is a simple way to check if the bot is responsive.
-    await update.message.reply_text("Pong! I am alive and running.")
-    logger.info(f"Responded to /ping command from user {update.effective_user.id}")
-
-
-async def forward_message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def forward_message_handler(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    _src: int = SOURCE_CHAT_ID,
+    _dst: int = DESTINATION_CHAT_ID,
+) -> None:
     """
-    Handles incoming messages, filters for the source chat,
+    Handles incoming messages from the source chat
     and forwards them to the destination chat.
     """
-    # We use effective_chat to handle different update types correctly.
-    # If the message is not from our source chat, we ignore it.
-    if not update.effective_chat or update.effective_chat.id != SOURCE_CHAT_ID:
-        return
+    # _src and _dst are bound as default arguments so this hot path reads them
+    # as fast locals instead of looking up module globals on every message.
+    # Updates from other chats never reach this function: the handler is
+    # registered with a filters.Chat(SOURCE_CHAT_ID) filter.
 
     # The message object can be None for some updates, so we check for it.
-    message = update.effective_message
+    # Most updates from the source chat are plain messages, so update.message
+    # is checked first. effective_message covers the rest (edits, channel posts).
+    message = update.message or update.effective_message
     if not message:
         logger.warning("Received an update with no effective message, ignoring.")
         return
 
+    copy_message = context.bot_data["copy_message"]
+    log_fields = {"msg_id": message.message_id, "src": _src, "dst": _dst}
     try:
-        # context.bot.copy_message is the best way to forward.
+        # copy_message is the best way to forward.
         # It works for text, photos, videos, stickers, etc., and looks clean.
-        await context.bot.copy_message(
-            chat_id=DESTINATION_CHAT_ID,
-            from_chat_id=SOURCE_CHAT_ID,
-            message_id=message.message_id
-        )
-        logger.info(f"Successfully forwarded message_id: {message.message_id} from {SOURCE_CHAT_ID}.")
-    except Exception as e:
-        # If forwarding fails, we log the specific error and the message ID.
-        logger.error(f"Failed to forward message_id: {message.message_id}. Error: {e}")
+        # It is bound once at startup (see main) and called with positional
+        # arguments: chat_id, from_chat_id, message_id.
+        # A RetryAfter is retried once by the rate limiter (see main).
+        async with context.bot_data["forward_lock"]:
+            await copy_message(_dst, _src, message.message_id)
+        logger.debug("forward_ok", extra=log_fields)
+    except BadRequest as e:
+        # BadRequest is a NetworkError subclass in PTB, but it is a permanent failure
+        # (e.g. a service message that can't be copied), so it is caught first.
+        logger.error("forward_fail", extra={**log_fields, "err": repr(e)})
+    except (TimedOut, NetworkError) as e:
+        # Timeouts and connection problems are expected now and then, so they are only warnings.
+        logger.warning("forward_fail", extra={**log_fields, "err": repr(e)})
+    except TelegramError as e:
+        # Any other API error means this message was not forwarded.
+        logger.error("forward_fail", extra={**log_fields, "err": repr(e)})
+    # Anything that isn't a TelegramError is a bug, so we let it reach PTB,
+    # which logs it together with the full traceback.
 
 # === MAIN APPLICATION ===
-if __name__ == '__main__':
-    # 1. Start the Flask server in the background.
-    run_flask_server()
+async def main() -> None:
+    # 1. Start the keep-alive server on this event loop.
+    runner = await start_health_server()
 
     # 2. Create the bot application instance.
     # We explicitly disable the job_queue as it's not needed and can cause issues.
-    application = Application.builder().token(TOKEN).job_queue(None).build()
-
-    # 3. Add the handlers.
-    # NEW: Add the handler for the /ping command.
-    application.add_handler(CommandHandler("ping", ping_command))
-    
-    # Add the handler for forwarding all other messages.
-    application.add_handler(MessageHandler(filters.ALL & ~filters.COMMAND, forward_message_handler))
-
-    # 4. Start the bot.
-    # run_polling() is a blocking call that runs the bot until it's stopped.
-    # The library handles the asyncio event loop internally.
-    logger.info("Starting Telegram bot polling...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    # concurrent_updates and block=False keep update processing from waiting on
+    # a slow copy_message call. The copies themselves are still sent one at a
+    # time under forward_lock, so messages arrive in the order they were sent.
+    # The connection pool matches the 256 connections PTB's builder uses by default;
+    # it has to be set here because HTTPXRequest on its own defaults to 1.
+    # With HTTP/2, concurrent forwards run as parallel streams over the same connection.
+    api_request = HTTPXRequest(
+        connection_pool_size=256,
+        http_version="2",
+        pool_timeout=10.0,
+        read_timeout=20.0,
+        connect_timeout=10.0,
+    )
+    # Telegram allows a bot roughly 30 messages per second overall and 20 per
+    # minute in a group. The rate limiter paces our requests to stay below those
+    # limits, so bursts get delayed instead of failing with RetryAfter.
+    # If Telegram still answers with RetryAfter, the limiter waits as long as it
+    # says and retries the request once.
+    rate_limiter = AIORateLimiter(
+        overall_max_rate=28,
+        overall_time_period=1,
+        group_max_rate=18,
+        group_time_period=60,
+        max_retries=1,
+    )
+    application = (
+        Application.builder()
+        .token(TOKEN)
+        .request(api_request)
+        .rate_limiter(rate_limiter)
+        .concurrent_updates(256)
+        .job_queue(None)
+        .build()
+    )
+    # Bind copy_message once so the handler doesn't look it up on every forward.
+    application.bot_data["copy_message"] = application.bot.copy_message
+    # asyncio.Lock wakes waiters in FIFO order, and handlers reach it in the order
+    # their updates arrived, so holding it around each copy keeps forwards in order.
+    application.bot_data["forward_lock"] = asyncio.Lock()
+
+    # 3. Add the handler.
+    # There is no /ping command: point uptime monitoring at the keep-alive
+    # server's "/" route instead, which doesn't use up Telegram API requests.
+    # The handler forwards every non-command message from the source chat.
+    # Filtering by chat here rejects unrelated updates before the handler is scheduled.
+    application.add_handler(MessageHandler(filters.Chat(chat_id=SOURCE_CHAT_ID) & ~filters.COMMAND, forward_message_handler, block=False))
+
+    # 4. Stop cleanly when the host sends SIGINT/SIGTERM (e.g. on a Render redeploy).
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # Signal handlers are not available on Windows; there Ctrl+C cancels
+            # main() and the finally blocks below shut the bot down.
+            pass
+
+    # 5. Start the bot and keep polling until we are told to stop.
+    try:
+        async with application:
+            try:
+                await application.start()
+                logger.info("Starting Telegram bot polling...")
+                await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+                await stop_event.wait()
+            finally:
+                # Stop whatever was started, even after an error or cancellation,
+                # so that leaving `async with` can shut the application down.
+                if application.updater.running:
+                    await application.updater.stop()
+                if application.running:
+                    await application.stop()
+    finally:
+        await runner.cleanup()
+
+if __name__ == '__main__':
+    # uvloop is a faster drop-in event loop for all of the bot's network I/O.
+    # It isn't available on Windows, so we fall back to the default loop there.
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        logger.info("uvloop is not installed, using the default asyncio event loop.")
+    asyncio.run(main())